@@ -1,11 +1,15 @@
 import os
+import sys
+import atexit
+import shutil
+import hashlib
 import tempfile
 from string import Template
-import copy
 import unittest
 import warnings
 import inspect
 import re
+import sysconfig
 
 import torch
 from torch._six import PY2
@@ -20,6 +24,29 @@ parity_table_path = os.path.join(os.path.dirname(__file__), 'cpp_api_parity/pari
 
 parity_table = parse_parity_tracker_table(parity_table_path)
 
+# Compiled C++ test extensions are cached in this directory across test runs, in a subdirectory per
+# build environment and keyed by a hash of their C++ sources and exported functions. Like other C++
+# extensions, it lives under `TORCH_EXTENSIONS_DIR` if that is set.
+cpp_module_cache_root = os.path.join(
+    os.environ.get('TORCH_EXTENSIONS_DIR') or torch.utils.cpp_extension.get_default_build_root(),
+    'cpp_api_parity_cache')
+
+# Fingerprint of the PyTorch build and the build environment that the C++ test extensions are
+# compiled against. It is computed lazily (once per process) by `_compute_build_env_fingerprint`.
+build_env_fingerprint = None
+
+# Compiled C++ test extensions that have already been loaded in this process, keyed by their cache directory.
+loaded_cpp_modules = {}
+
+# All serialized modules passed from Python to C++ are written into this directory,
+# which is removed when the test process exits. We prefer a shared-memory filesystem
+# if one is available, so that the serialized bytes never have to hit the disk.
+if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+    serialized_module_tmp_root = tempfile.mkdtemp(prefix='torch_nn_parity_', dir='/dev/shm')
+else:
+    serialized_module_tmp_root = tempfile.mkdtemp(prefix='torch_nn_parity_')
+atexit.register(shutil.rmtree, serialized_module_tmp_root, ignore_errors=True)
+
 TORCH_NN_MODULE_COMMON_TEST_HARNESS = """\n
 #include <torch/script.h>
 
@@ -30,10 +57,13 @@ const char * const parity_test_error_msg_prefix = "Parity test failed: ";
   name, " in C++ has value: ", cpp_value, ", which does not match the corresponding value in Python: ", python_value \
 
 bool check_tensor_equality(const torch::Tensor& tensor1, const torch::Tensor& tensor2) {
-  return tensor1.sizes().vec() == tensor2.sizes().vec() && \
+  // We first compare the tensor metadata, which doesn't read any tensor data.
+  // Python and C++ use the same seed and math, so the tensors are usually bitwise equal.
+  // `equal()` checks that in a single pass, and we only fall back to `allclose()` if it fails.
+  return tensor1.sizes() == tensor2.sizes() && \
     tensor1.device() == tensor2.device() && \
     tensor1.dtype() == tensor2.dtype() && \
-    tensor1.allclose(tensor2);
+    (tensor1.equal(tensor2) || tensor1.allclose(tensor2));
 }
 
 bool check_ivalue_equality(const c10::IValue& ivalue_python, const c10::IValue& ivalue_cpp) {
@@ -86,6 +116,45 @@ bool check_ivalue_equality(const c10::IValue& ivalue_python, const c10::IValue&
     AT_ERROR("Unsupported value type: ", ivalue_python.tagKind());
   }
 }
+
+torch::Tensor flatten_and_cat(const std::vector<torch::Tensor>& tensors) {
+  std::vector<torch::Tensor> flattened_tensors;
+  flattened_tensors.reserve(tensors.size());
+  for (const auto& tensor : tensors) {
+    flattened_tensors.push_back(tensor.flatten());
+  }
+  return torch::cat(flattened_tensors);
+}
+
+void load_tensor_from_state_dict(
+    const std::string& name,
+    torch::Tensor& cpp_tensor,
+    const std::map<std::string, torch::Tensor>& state_dict) {
+  TORCH_CHECK(
+    state_dict.count(name),
+    parity_test_error_msg_prefix, "`", name, "` exists in C++ but not in Python");
+  const auto& python_tensor = state_dict.at(name);
+  // `copy_()` would silently broadcast and cast the Python tensor, so we check that it matches first.
+  TORCH_CHECK(
+    cpp_tensor.sizes() == python_tensor.sizes() && cpp_tensor.dtype() == python_tensor.dtype(),
+    parity_test_error_msg_prefix,
+    "`", name, "` in C++ has sizes ", cpp_tensor.sizes(), " and dtype ", cpp_tensor.dtype(),
+    ", which does not match the corresponding sizes ", python_tensor.sizes(),
+    " and dtype ", python_tensor.dtype(), " in Python");
+  cpp_tensor.copy_(python_tensor);
+}
+
+void load_state_dict_into_module(
+    torch::nn::Module& module,
+    const std::map<std::string, torch::Tensor>& state_dict) {
+  torch::NoGradGuard no_grad;
+  for (auto& named_param : module.named_parameters()) {
+    load_tensor_from_state_dict(named_param.key(), named_param.value(), state_dict);
+  }
+  for (auto& named_buffer : module.named_buffers()) {
+    load_tensor_from_state_dict(named_buffer.key(), named_buffer.value(), state_dict);
+  }
+}
 """
 
 CHECK_MODULE_PARAM_EQUALITY = Template("""\
@@ -135,7 +204,7 @@ m_init_by_cpp->options.${options_arg_name}();
 """)
 
 TORCH_NN_MODULE_TEST_INIT = Template("""\n
-void ${module_variant_name}_test_init(
+void ${module_name}_test_init(
     const std::string& saved_module_path,
     const std::string& device) {
   torch::jit::Module m_init_by_python = torch::jit::load(saved_module_path);
@@ -149,14 +218,14 @@ void ${module_variant_name}_test_init(
 """)
 
 TORCH_NN_MODULE_TEST_FORWARD = Template("""\n
-void ${module_variant_name}_test_forward(
-    const std::string& saved_module_path,
+void ${module_name}_test_forward(
+    const std::map<std::string, torch::Tensor>& python_state_dict,
     const std::string& device,
     torch::Tensor python_output,
     ${input_arg_declarations}) {
   torch::manual_seed(2);
   ${module_qualified_name} module${cpp_constructor_args};
-  torch::load(module, saved_module_path);
+  load_state_dict_into_module(*module, python_state_dict);
   module->to(device);
 
   auto cpp_output = module(${input_args});
@@ -173,31 +242,61 @@ void ${module_variant_name}_test_forward(
 """)
 
 TORCH_NN_MODULE_TEST_BACKWARD = Template("""\n
-void ${module_variant_name}_test_backward(
-    const std::string& saved_module_path,
-    const std::string& saved_grad_module_path,
+void ${module_name}_test_backward(
+    const std::map<std::string, torch::Tensor>& python_state_dict,
+    const std::map<std::string, torch::Tensor>& python_grad_dict,
     const std::string& device,
     ${input_arg_declarations}) {
-  ${module_qualified_name} python_grad_module${cpp_constructor_args};
-  torch::load(python_grad_module, saved_grad_module_path);
-
   torch::manual_seed(2);
   ${module_qualified_name} module${cpp_constructor_args};
-  torch::load(module, saved_module_path);
+  load_state_dict_into_module(*module, python_state_dict);
   module->to(device);
 
   auto cpp_output = module(${input_args});
   cpp_output.sum().backward();
 
-  for (size_t i = 0; i < module->parameters().size(); i++) {
-    auto named_param = module->named_parameters()[i];
-    auto grad = python_grad_module->parameters()[i];
-    TORCH_CHECK(
-      check_tensor_equality(named_param->grad(), grad),
-      GENERATE_PARITY_TEST_ERROR_MSG(
-        "gradient of `" + named_param.key() + "`",
-        named_param->grad(),
-        grad));
+  std::vector<std::string> grad_names;
+  std::vector<torch::Tensor> cpp_grads;
+  std::vector<torch::Tensor> python_grads;
+  // Comparing the flattened concatenation of all gradients requires that they have matching sizes,
+  // and that all of them are dense and have the same dtype and device (so that they can be concatenated).
+  bool can_compare_flattened_grads = true;
+  for (const auto& named_param : module->named_parameters()) {
+    if (!python_grad_dict.count(named_param.key())) {
+      TORCH_CHECK(
+        !named_param->grad().defined(),
+        parity_test_error_msg_prefix,
+        "gradient of `", named_param.key(), "` is defined in C++ but not in Python");
+      continue;
+    }
+    grad_names.push_back(named_param.key());
+    cpp_grads.push_back(named_param->grad());
+    python_grads.push_back(python_grad_dict.at(named_param.key()));
+    const auto& cpp_grad = cpp_grads.back();
+    const auto& python_grad = python_grads.back();
+    can_compare_flattened_grads = can_compare_flattened_grads && \
+      cpp_grad.defined() && \
+      cpp_grad.sizes() == python_grad.sizes() && \
+      !cpp_grad.is_sparse() && !python_grad.is_sparse() && \
+      cpp_grad.dtype() == cpp_grads.front().dtype() && \
+      python_grad.dtype() == cpp_grads.front().dtype() && \
+      cpp_grad.device() == cpp_grads.front().device() && \
+      python_grad.device() == cpp_grads.front().device();
+  }
+
+  // We compare all gradients at once on their flattened concatenation, and only compare
+  // them one by one (to find the mismatching gradient) if that fails.
+  if (!grad_names.empty() &&
+      (!can_compare_flattened_grads ||
+       !check_tensor_equality(flatten_and_cat(cpp_grads), flatten_and_cat(python_grads)))) {
+    for (size_t i = 0; i < grad_names.size(); i++) {
+      TORCH_CHECK(
+        check_tensor_equality(cpp_grads[i], python_grads[i]),
+        GENERATE_PARITY_TEST_ERROR_MSG(
+          "gradient of `" + grad_names[i] + "`",
+          cpp_grads[i],
+          python_grads[i]));
+    }
   }
 
   ${extra_stmts}
@@ -237,14 +336,104 @@ class TestCppApiParity(common.TestCase):
             raise RuntimeError(
                 "{} is not a supported arg type for C++ module methods".format(type(python_arg)))
 
+    def _load_cached_cpp_module(self, name, cpp_sources, functions):
+        if isinstance(functions, str):
+            functions = [functions]
+
+        cache_dir = _compute_cpp_module_cache_dir(name, cpp_sources, functions)
+        if cache_dir in loaded_cpp_modules:
+            return loaded_cpp_modules[cache_dir]
+
+        # If the exact same C++ sources have been compiled by a previous test run,
+        # we load the cached extension instead of compiling it again.
+        cache_metadata_path = os.path.join(cache_dir, 'cpp_module_metadata.txt')
+        if os.path.exists(cache_metadata_path):
+            with open(cache_metadata_path, 'r') as f:
+                cpp_module_name = f.readline().strip()
+            try:
+                cpp_module = torch.utils.cpp_extension._import_module_from_library(cpp_module_name, cache_dir, True)
+            except Exception as e:
+                # The cached extension can't be loaded (e.g. it is truncated or was built with an incompatible
+                # compiler), so we remove it and let the caller compile the C++ test code again.
+                warnings.warn("Unable to load cached C++ extension {}, got error: {}".format(cache_dir, str(e)))
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                return None
+            loaded_cpp_modules[cache_dir] = cpp_module
+            return cpp_module
+
+        return None
+
     def _compile_cpp_code_inline(self, name, cpp_sources, functions):
-        # Just-in-time compile the C++ test code
-        cpp_module = torch.utils.cpp_extension.load_inline(
-            name=name,
-            cpp_sources=cpp_sources,
-            functions=functions,
-            verbose=False,
-        )
+        if isinstance(functions, str):
+            functions = [functions]
+
+        cpp_module = self._load_cached_cpp_module(name, cpp_sources, functions)
+        if cpp_module is not None:
+            return cpp_module
+
+        cache_dir = _compute_cpp_module_cache_dir(name, cpp_sources, functions)
+        cache_env_dir = os.path.dirname(cache_dir)
+        try:
+            if not os.path.isdir(cache_env_dir):
+                # Cache entries built against a different PyTorch build or build environment
+                # can never be hit again, so we remove them.
+                if os.path.isdir(cpp_module_cache_root):
+                    for stale_env_dir_name in os.listdir(cpp_module_cache_root):
+                        shutil.rmtree(os.path.join(cpp_module_cache_root, stale_env_dir_name), ignore_errors=True)
+                os.makedirs(cache_env_dir)
+            build_directory = tempfile.mkdtemp(dir=cache_env_dir)
+        except OSError as e:
+            # If the cache directory is not writable, we compile the C++ test code in a
+            # temporary directory without caching it.
+            warnings.warn("Unable to use {} as C++ extension cache, got error: {}".format(
+                cpp_module_cache_root, str(e)))
+            build_directory = tempfile.mkdtemp(prefix='torch_cpp_api_parity_')
+            atexit.register(shutil.rmtree, build_directory, ignore_errors=True)
+            cpp_module = torch.utils.cpp_extension.load_inline(
+                name=name,
+                cpp_sources=cpp_sources,
+                functions=functions,
+                build_directory=build_directory,
+                verbose=False,
+            )
+            loaded_cpp_modules[cache_dir] = cpp_module
+            return cpp_module
+
+        # Just-in-time compile the C++ test code into a scratch build directory,
+        # and then atomically move the build directory into the cache.
+        try:
+            cpp_module = torch.utils.cpp_extension.load_inline(
+                name=name,
+                cpp_sources=cpp_sources,
+                functions=functions,
+                build_directory=build_directory,
+                verbose=False,
+            )
+        except Exception:
+            # Don't leave partial builds (e.g. of C++ modules that don't have parity yet) in the cache.
+            shutil.rmtree(build_directory, ignore_errors=True)
+            raise
+        # Only the compiled extension is needed to load it again, so we remove the other
+        # build artifacts (sources, object files, ninja files) before caching it.
+        cpp_module_file_name = os.path.basename(cpp_module.__file__)
+        for file_name in os.listdir(build_directory):
+            if file_name != cpp_module_file_name:
+                file_path = os.path.join(build_directory, file_name)
+                if os.path.isdir(file_path):
+                    shutil.rmtree(file_path, ignore_errors=True)
+                else:
+                    os.remove(file_path)
+        # NOTE: The extension module name can differ from `name` (e.g. `name_v1`) if an extension
+        # with the same name has already been compiled in this process, so we store the actual name
+        # alongside the function list.
+        with open(os.path.join(build_directory, 'cpp_module_metadata.txt'), 'w') as f:
+            f.write('\n'.join([cpp_module.__name__] + sorted(functions)))
+        try:
+            os.rename(build_directory, cache_dir)
+        except OSError:
+            # Another test process has populated the same cache entry in the meantime.
+            shutil.rmtree(build_directory, ignore_errors=True)
+        loaded_cpp_modules[cache_dir] = cpp_module
         return cpp_module
 
     def _get_python_module_init_arg_spec(self, module_name):
@@ -263,6 +452,10 @@ class TestCppApiParity(common.TestCase):
         else:
             raise RuntimeError("Unexpected input type: {}".format(type(tensors)))
 
+        # The test instance (and the tensors it caches) is shared among the variants for all devices,
+        # so we copy the tensors to keep autograd state and in-place changes from leaking between variants.
+        tensors = [x.detach().clone() for x in tensors]
+
         if test_params.device != 'cuda' or TEST_CUDA:
             tensors = [x.to(test_params.device) for x in tensors]
 
@@ -357,24 +550,28 @@ class TestCppApiParity(common.TestCase):
 
     def _test_torch_nn_module_variant(self, test_params):
         def get_python_ignored_attrs(module_metadata):
-            return list(TORCH_NN_MODULE_IGNORED_ATTRS) + module_metadata.python_ignored_attrs
+            return TORCH_NN_MODULE_IGNORED_ATTRS.union(module_metadata.python_ignored_attrs)
 
-        def generate_test_cpp_sources(test_params, template, extra_stmts):
-            input_args = self._get_forward_input_args(test_params)
+        def compute_cpp_input_arg_declarations_and_symbols(input_args):
             input_arg_types = [self._python_arg_to_cpp_arg(arg).type for arg in list(input_args)]
-            input_args = ['arg{}'.format(str(i)) for i in range(len(input_arg_types))]
-            input_arg_declarations = ['{} {}'.format(arg_type, arg_name) for arg_type, arg_name in zip(input_arg_types, input_args)]
+            input_arg_symbols = ['arg{}'.format(str(i)) for i in range(len(input_arg_types))]
+            input_arg_declarations = [
+                '{} {}'.format(arg_type, arg_name) for arg_type, arg_name in zip(input_arg_types, input_arg_symbols)]
+            return ',\n'.join(input_arg_declarations), ',\n'.join(input_arg_symbols)
+
+        def generate_test_cpp_sources(test_params, template, extra_stmts, input_arg_declarations, input_arg_symbols):
             test_cpp_sources = template.substitute(
-                module_variant_name=test_params.module_variant_name,
+                module_name=test_params.module_name,
                 module_qualified_name='torch::nn::{}'.format(test_params.module_name),
                 cpp_constructor_args=test_params.cpp_constructor_args,
-                input_arg_declarations=',\n'.join(input_arg_declarations),
-                input_args=',\n'.join(input_args),
+                input_arg_declarations=input_arg_declarations,
+                input_args=input_arg_symbols,
                 extra_stmts=extra_stmts)
             return test_cpp_sources
 
         def setup_init_test(test_params):
             module_metadata = torch_nn_modules.module_metadata_map[test_params.module_name]
+            python_ignored_attrs = get_python_ignored_attrs(module_metadata)
 
             # We are generating the attribute equality checks manually here,
             # because it is not possible to have a `.attributes()` API that returns
@@ -400,10 +597,10 @@ class TestCppApiParity(common.TestCase):
 
                 init_arg_spec = self._get_python_module_init_arg_spec(module.__class__.__name__)
                 # NOTE: `init_arg_spec.args[0]` is `self`, which is not counted as a constructor arg in the API parity test.
-                python_constructor_arg_names = [
-                    x for x in init_arg_spec.args[1:] if x not in module_metadata.python_ignored_constructor_args]
+                python_constructor_arg_names = set(
+                    x for x in init_arg_spec.args[1:] if x not in module_metadata.python_ignored_constructor_args)
                 for name, attr in module.__dict__.items():
-                    if name not in get_python_ignored_attrs(module_metadata):
+                    if name not in python_ignored_attrs:
                         # Every constructor arg of the Python module must have
                         # a corresponding C++ module options arg.
                         if name in python_constructor_arg_names:
@@ -427,9 +624,7 @@ class TestCppApiParity(common.TestCase):
             extra_stmts = generate_attr_equality_checks(module)
             assert len(extra_stmts) == module_metadata.num_attrs_recursive
             extra_stmts_str = ''.join(extra_stmts)
-            return (([module], device),
-                    generate_test_cpp_sources(
-                        test_params=test_params, template=TORCH_NN_MODULE_TEST_INIT, extra_stmts=extra_stmts_str))
+            return ([module], device), TORCH_NN_MODULE_TEST_INIT, extra_stmts_str
 
         def setup_forward_test(test_params):
             device = test_params.device
@@ -441,9 +636,7 @@ class TestCppApiParity(common.TestCase):
             module = python_constructor(*python_constructor_args).to(device)
             python_output = module(*input_args)
 
-            return (([module], device, python_output, input_args),
-                    generate_test_cpp_sources(
-                        test_params=test_params, template=TORCH_NN_MODULE_TEST_FORWARD, extra_stmts=''))
+            return ([], module.state_dict(), device, python_output, input_args), TORCH_NN_MODULE_TEST_FORWARD, ''
 
         def setup_backward_test(test_params):
             device = test_params.device
@@ -455,22 +648,13 @@ class TestCppApiParity(common.TestCase):
             module = python_constructor(*python_constructor_args).to(device)
             python_output = module(*input_args)
             python_output.sum().backward()
-            # JIT tracing does not save a module's parameters' gradients into ScriptModule.
-            # Instead, we create another module `grad_module` with the same structure as `module`,
-            # and use `grad_module`'s parameters to save `module`'s corresponding parameters'
-            # gradients. Then, we trace both `module` and `grad_module`, serialize them and
-            # pass them into C++ for parity testing.
-            grad_module = copy.deepcopy(module)
-            for param, grad_param in zip(module.parameters(), grad_module.parameters()):
-                if param.grad is not None:
-                    grad_param.data = param.grad
-
-            return (([module, grad_module], device, input_args),
-                    generate_test_cpp_sources(
-                        test_params=test_params, template=TORCH_NN_MODULE_TEST_BACKWARD, extra_stmts=''))
+            grad_dict = {name: param.grad for name, param in module.named_parameters() if param.grad is not None}
+
+            return ([], module.state_dict(), grad_dict, device, input_args), TORCH_NN_MODULE_TEST_BACKWARD, ''
 
         def trace_module(module, input_args):
             module_metadata = torch_nn_modules.module_metadata_map[module.__class__.__name__]
+            python_ignored_attrs = get_python_ignored_attrs(module_metadata)
 
             # JIT tracing does not automatically save a module's non-parameter / non-buffer attributes
             # into a ScriptModule's slots, which means we can't access them via `get_attributes()` in C++.
@@ -480,7 +664,7 @@ class TestCppApiParity(common.TestCase):
                 for sub_module, sub_script_module in zip(module.children(), script_module.children()):
                     register_attrs(sub_module, sub_script_module)
                 for key, value in module.__dict__.items():
-                    if key not in get_python_ignored_attrs(module_metadata):
+                    if key not in python_ignored_attrs:
                         if value is None:
                             value_type = module_metadata.python_optional_attribute_to_jit_type[key]
                         elif type(value) == tuple:
@@ -495,25 +679,39 @@ class TestCppApiParity(common.TestCase):
                             value_type = torch.jit.annotations.ann_to_type(type(value))
                         script_module._c._register_attribute(key, value_type, value)
 
-            # We use JIT tracing to serialize Python module state, so that we can load it into C++
-            traced_script_module = torch.jit.trace(module, input_args)
+            # We use JIT tracing to serialize Python module state, so that we can load it into C++.
+            # The C++ init test only reads the parameters, buffers and attributes of the ScriptModule
+            # and never runs its forward, so we skip the trace checker, which would otherwise re-trace
+            # the module and run the traced graph and the Python module again to compare their outputs.
+            # For the same reason, we trace under `no_grad()` to avoid recording autograd history for the
+            # forward pass; the ScriptModule still shares the module's parameters, including `requires_grad`.
+            with torch.no_grad():
+                traced_script_module = torch.jit.trace(module, input_args, check_trace=False)
             register_attrs(module, traced_script_module)
             return traced_script_module
 
-        def serialize_module_into_file(script_module):
-            module_file = tempfile.NamedTemporaryFile(delete=False)
-            script_module.save(module_file.name)
-            module_file.close()
-            return module_file.name
+        def serialize_module_into_file(module, input_args, file_name):
+            # The init test accesses the module's attributes in C++, which requires a serialized ScriptModule.
+            # All other tests receive the module state directly as tensor dicts.
+            module_file_name = os.path.join(serialized_module_tmp_root, file_name)
+            trace_module(module, input_args).save(module_file_name)
+            return module_file_name
 
         def test_methods(test_params):
             module_metadata = torch_nn_modules.module_metadata_map[test_params.module_name]
             module_variant_name = test_params.module_variant_name
+            # The generated C++ test functions are named after the module (not the variant), and the device
+            # is passed into them as an argument. This way, all variants of a module whose generated C++ code
+            # is identical (e.g. the CPU and CUDA variants of a test, or variants that only differ in input
+            # sizes) hash to the same key in `_compile_cpp_code_inline`, and share one compiled extension.
+            module_name = test_params.module_name
             input_args = self._get_forward_input_args(test_params)
 
             args_map = {}
 
             cpp_sources = TORCH_NN_MODULE_COMMON_TEST_HARNESS + module_metadata.cpp_sources
+            # The C++ forward arg declarations are shared by all test methods, so we only compute them once.
+            input_arg_declarations, input_arg_symbols = compute_cpp_input_arg_declarations_and_symbols(input_args)
 
             torch_nn_test_methods = [
                 ('init', setup_init_test),
@@ -521,21 +719,27 @@ class TestCppApiParity(common.TestCase):
                 ('backward', setup_backward_test),
             ]
             for method_name, setup_test in torch_nn_test_methods:
-                args_map[method_name], test_cpp_sources = setup_test(test_params)
-                cpp_sources += test_cpp_sources
+                args_map[method_name], template, extra_stmts = setup_test(test_params)
+                cpp_sources += generate_test_cpp_sources(
+                    test_params=test_params,
+                    template=template,
+                    extra_stmts=extra_stmts,
+                    input_arg_declarations=input_arg_declarations,
+                    input_arg_symbols=input_arg_symbols)
 
             cpp_module = self._compile_cpp_code_inline(
-                name=test_params.module_variant_name,
+                name=module_name,
                 cpp_sources=cpp_sources,
                 functions=['{}_test_{}'.format(
-                    test_params.module_variant_name,
+                    module_name,
                     method_name) for method_name, _ in torch_nn_test_methods])
 
             for method_name, _ in torch_nn_test_methods:
                 args = args_map[method_name]
-                modules = args[0]
-                script_modules = [trace_module(module, input_args) for module in modules]
-                module_file_names = [serialize_module_into_file(script_module) for script_module in script_modules]
+                module_file_names = [
+                    serialize_module_into_file(
+                        module, input_args, '{}_{}_{}.pt'.format(module_variant_name, method_name, i))
+                    for i, module in enumerate(args[0])]
 
                 cpp_args = module_file_names[:]
                 for arg in args[1:]:
@@ -547,7 +751,7 @@ class TestCppApiParity(common.TestCase):
                         cpp_args.append(arg)
 
                 try:
-                    cpp_test_name = '{}_test_{}'.format(module_variant_name, method_name)
+                    cpp_test_name = '{}_test_{}'.format(module_name, method_name)
                     cpp_test_fn = getattr(cpp_module, cpp_test_name)
                     if not test_params.has_parity:
                         with self.assertRaisesRegex(RuntimeError, "Parity test failed"):
@@ -555,16 +759,65 @@ class TestCppApiParity(common.TestCase):
                     else:
                         cpp_test_fn(*cpp_args)
                 finally:
-                    # Ideally we would like to not have to manually delete the file, but NamedTemporaryFile
-                    # opens the file, and it cannot be opened multiple times in Windows. To support Windows,
-                    # we close the file after creation and try to remove it manually.
+                    # We remove the files as soon as the test finishes instead of waiting for the
+                    # temporary directory to be removed at exit, to keep the directory small.
                     for module_file_name in module_file_names:
                         try:
                             os.remove(module_file_name)
                         except OSError as e:
                             warnings.warn("Unable to remove {}, got error: {}".format(module_file_name, str(e)))
 
-        test_methods(test_params)
+        # The test seeds the global RNG (both in Python and in C++), so we fork the RNG to restore its
+        # state afterwards, and avoid changing the random numbers seen by the tests that run after this one.
+        # NOTE: Seeding reseeds all CUDA devices regardless of the variant's device, so we fork all of them.
+        rng_devices = list(range(torch.cuda.device_count())) if TEST_CUDA else []
+        with torch.random.fork_rng(devices=rng_devices):
+            test_methods(test_params)
+
+
+def _compute_build_env_fingerprint():
+    global build_env_fingerprint
+    if build_env_fingerprint is not None:
+        return build_env_fingerprint
+
+    entries = [
+        torch.__version__,
+        str(torch.version.git_version),
+        # The Python interpreter that the extension is built for.
+        sys.version,
+        str(sysconfig.get_config_var('EXT_SUFFIX') or sysconfig.get_config_var('SO')),
+        # The compiler and the build arguments used by `torch.utils.cpp_extension`.
+        str(os.environ.get('CXX')),
+        str(os.environ.get('TORCH_CUDA_ARCH_LIST')),
+        str(torch.utils.cpp_extension.CUDA_HOME),
+    ]
+
+    # The PyTorch headers and libraries can change without a version change (e.g. when a developer
+    # edits the C++ API and rebuilds), so we also include the path, size and modification time of
+    # each of them.
+    torch_dir = os.path.dirname(os.path.abspath(torch.__file__))
+    file_paths = [torch._C.__file__]
+    for root_dir in [os.path.join(torch_dir, 'include'), os.path.join(torch_dir, 'lib')]:
+        for dir_path, dir_names, file_names in os.walk(root_dir, followlinks=True):
+            dir_names.sort()
+            file_paths += [os.path.join(dir_path, file_name) for file_name in sorted(file_names)]
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        entries.append('{}:{}:{}'.format(file_path, stat.st_size, stat.st_mtime))
+
+    hasher = hashlib.sha1()
+    hasher.update('\n'.join(entries).encode('utf-8'))
+    build_env_fingerprint = hasher.hexdigest()
+    return build_env_fingerprint
+
+
+def _compute_cpp_module_cache_dir(name, cpp_sources, functions):
+    hasher = hashlib.sha1()
+    hasher.update(cpp_sources.encode('utf-8'))
+    hasher.update(','.join(sorted(functions)).encode('utf-8'))
+    # The compiled extension is only valid for the PyTorch build and the build environment it was compiled with.
+    return os.path.join(
+        cpp_module_cache_root, _compute_build_env_fingerprint(), '{}_{}'.format(name, hasher.hexdigest()))
 
 
 def _compute_module_name(test_params_dict):
@@ -579,19 +832,23 @@ def _compute_module_name(test_params_dict):
     return module_name
 
 
-def _process_test_params(test_params_dict, module_metadata, device, is_criterion):
+def _create_test_instance(test_params_dict, is_criterion):
     module_name = _compute_module_name(test_params_dict)
     test_params_dict['constructor'] = test_params_dict.get('constructor', getattr(torch.nn, module_name))
     if is_criterion:
-        test = common_nn.CriterionTest(**test_params_dict)
+        return common_nn.CriterionTest(**test_params_dict)
     else:
-        test = common_nn.ModuleTest(**test_params_dict)
-    module_variant_name = test.get_name()[5:] + (('_' + device) if device != 'cpu' else '')
+        return common_nn.ModuleTest(**test_params_dict)
+
+
+def _process_test_params(test_params_dict, test_instance, device):
+    module_name = _compute_module_name(test_params_dict)
+    module_variant_name = test_instance.get_name()[5:] + (('_' + device) if device != 'cpu' else '')
 
     return TorchNNTestParams(
         module_name=module_name,
         module_variant_name=module_variant_name,
-        test_instance=test,
+        test_instance=test_instance,
         cpp_constructor_args=test_params_dict.get('cpp_constructor_args'),
         has_parity=test_params_dict.get('has_parity', True),
         device=device,
@@ -607,8 +864,6 @@ def add_test(test_name, test_fn):
 
 devices = ['cpu', 'cuda']
 
-torch_nn_test_params_map = {}
-
 
 def add_torch_nn_module_tests(module_tests, is_criterion):
     for test_params_dict in module_tests:
@@ -646,18 +901,20 @@ def add_torch_nn_module_tests(module_tests, is_criterion):
                 add_test(ctor_args_test_name, ctor_args_test)
 
         def add_variant_test_for_module(module_name, test_params_dict, has_impl_parity):
-            module_metadata = torch_nn_modules.module_metadata_map[module_name]
+            # The test instance (and the example inputs it lazily creates and caches) doesn't depend
+            # on the device, so we create it once and share it among the variants for all devices.
+            test_instance = _create_test_instance(test_params_dict, is_criterion)
             for device in devices:
                 test_params = _process_test_params(
                     test_params_dict=test_params_dict,
-                    module_metadata=module_metadata,
-                    device=device,
-                    is_criterion=is_criterion)
+                    test_instance=test_instance,
+                    device=device)
                 test_name = 'test_torch_nn_{}'.format(test_params.module_variant_name)
-                torch_nn_test_params_map[test_name] = test_params
 
-                def test_fn(self):
-                    self._test_torch_nn_module_variant(test_params=torch_nn_test_params_map[self._testMethodName])
+                # NOTE: `test_params` is bound as a default arg, so that each test function
+                # captures the test params of its own variant instead of the loop variable.
+                def test_fn(self, test_params=test_params):
+                    self._test_torch_nn_module_variant(test_params=test_params)
 
                 if device == 'cuda':
                     test_fn = unittest.skipIf(not TEST_CUDA, "CUDA unavailable")(test_fn)